@@ -5,25 +5,41 @@ Telegram Bot для общения с клиентами
 """
 
 import asyncio
-import html
+import itertools
 import logging
+import logging.handlers
 import os
+import queue
+import signal
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
 from dataclasses import dataclass
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Optional
-
-from aiogram import Bot, Dispatcher, F, Router
-from aiogram.filters import Command, CommandStart
+from typing import Any, Awaitable, Callable, Iterable, Iterator, NamedTuple, Optional
+
+from aiogram import BaseMiddleware, Bot, Dispatcher, F, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.filters import Command, CommandObject, CommandStart, StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiogram.types import (
     CallbackQuery,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     Message,
+    TelegramObject,
 )
 from aiogram.enums import ParseMode
+from aiohttp import web
 from dotenv import load_dotenv
 
-from database import Database
+from database import Database, MessageRow
 
 # ===== НАСТРОЙКА ЛОГИРОВАНИЯ =====
 log_handlers = [logging.StreamHandler()]
@@ -34,11 +50,18 @@ if log_file:
         log_path.parent.mkdir(parents=True, exist_ok=True)
     log_handlers.append(logging.FileHandler(log_path, encoding="utf-8"))
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-    handlers=log_handlers,
-)
+log_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+for log_handler in log_handlers:
+    log_handler.setFormatter(log_formatter)
+
+# Запись логов в консоль/файл выполняется в отдельном потоке, чтобы не блокировать event loop.
+# QueueHandler подключается вместе с запуском потока (см. __main__): при импорте модуля
+# записи иначе копились бы в очереди, которую никто не читает
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
 logger = logging.getLogger(__name__)
 
 
@@ -49,20 +72,47 @@ class Settings:
     token: str
     admin_chat_id: int
     database_path: str = "data/bot.db"
+    # Если задан WEBHOOK_URL, бот получает обновления через webhook, иначе — long polling
+    webhook_url: Optional[str] = None
+    webhook_path: str = "/webhook"
+    webhook_secret: Optional[str] = None
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8443
+    # Текстовые уведомления админу копятся столько секунд и отправляются одним сообщением
+    admin_batch_interval: float = 1.0
+    admin_buffer_size: int = 1000
+    # Сколько последних сообщений хранить на клиента (0 — хранить всё)
+    history_keep: int = 0
 
     @classmethod
+    @lru_cache(maxsize=1)
     def load(cls) -> "Settings":
-        """Загрузка настроек из переменных окружения"""
+        """Загрузка настроек из переменных окружения (читаются один раз)"""
         load_dotenv()
-        token = os.getenv("BOT_TOKEN")
-        admin_chat_id = os.getenv("ADMIN_CHAT_ID")
+        env = os.environ
+        token = env.get("BOT_TOKEN")
+        admin_chat_id = env.get("ADMIN_CHAT_ID")
 
         if not token:
             raise RuntimeError("BOT_TOKEN не установлен в .env файле")
         if not admin_chat_id:
             raise RuntimeError("ADMIN_CHAT_ID не установлен в .env файле")
-
-        return cls(token=token, admin_chat_id=int(admin_chat_id))
+        # Без секрета любой, кто узнал адрес webhook, может присылать поддельные обновления
+        if env.get("WEBHOOK_URL") and not env.get("WEBHOOK_SECRET"):
+            raise RuntimeError("WEBHOOK_SECRET не установлен в .env файле (обязателен вместе с WEBHOOK_URL)")
+
+        return cls(
+            token=token,
+            admin_chat_id=int(admin_chat_id),
+            webhook_url=env.get("WEBHOOK_URL") or None,
+            webhook_path=env.get("WEBHOOK_PATH", "/webhook"),
+            webhook_secret=env.get("WEBHOOK_SECRET") or None,
+            webhook_host=env.get("WEBHOOK_HOST", "0.0.0.0"),
+            webhook_port=int(env.get("PORT", "8443")),
+            admin_batch_interval=float(env.get("ADMIN_BATCH_INTERVAL", "1.0")),
+            admin_buffer_size=int(env.get("ADMIN_BUFFER_SIZE", "1000")),
+            history_keep=int(env.get("HISTORY_KEEP", "0")),
+        )
 
 
 # Глобальные переменные
@@ -70,35 +120,528 @@ settings: Optional[Settings] = None
 db: Optional[Database] = None
 bot: Optional[Bot] = None
 
-# Словарь для отслеживания ожидающих ответов (user_id -> prompt_message_id)
-pending_replies: dict[int, int] = {}
 
-# Роутер для всех обработчиков
+class ReplyStates(StatesGroup):
+    """Состояния админа при ответе клиенту"""
+    waiting_text = State()
+
+
+@dataclass(slots=True)
+class PendingReply:
+    """Ожидаемый ответ админа: кому отвечаем и какое приглашение удалить"""
+    user_id: int
+    prompt_message_id: int
+
+
+# Отдельный пул потоков для запросов к базе: по потоку на соединение-читатель,
+# чтобы всплеск запросов к базе не занимал общий пул asyncio
+DB_WORKERS = 4
+_db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+
+# Очередь сообщений на запись в базу (пишутся пачками фоновой задачей)
+MESSAGE_QUEUE_SIZE = 10_000
+MESSAGE_BATCH_SIZE = 100
+MESSAGE_FLUSH_INTERVAL = 0.2
+msg_queue: asyncio.Queue[Optional[MessageRow]] = asyncio.Queue(maxsize=MESSAGE_QUEUE_SIZE)
+
+class AdminNotice(NamedTuple):
+    """Уведомление админу: текст клиента или отправка его медиа (send)"""
+    user_id: int
+    display_name: str
+    text: Optional[str] = None
+    send: Optional[Callable[[], Awaitable[Any]]] = None
+
+
+# Очередь уведомлений админу. Тексты и медиа идут через одну очередь,
+# чтобы админ видел их в том порядке, в котором писал клиент.
+# Создаётся в main(), размер задаётся настройкой admin_buffer_size
+ADMIN_BATCH_SIZE = 50
+admin_queue: Optional[asyncio.Queue[Optional[AdminNotice]]] = None
+
+# Кэш списка клиентов: (время обновления, список) и индекс по user_id
+CLIENTS_CACHE_TTL = 5.0
+# Сколько последних активных клиентов показывать в /clients
+CLIENTS_LIST_LIMIT = 20
+_clients_cache: Optional[tuple[float, list[tuple[int, Optional[str], Optional[str], str]]]] = None
+_clients_by_id: dict[int, tuple[int, Optional[str], Optional[str], str]] = {}
+# Заранее подготовленные строки списка: (user_id, имя для кнопки, строка списка в HTML)
+_clients_rendered: list[tuple[int, str, str]] = []
+
+# LRU-кэш истории на HISTORY_CACHE_SIZE клиентов: user_id -> {limit: строки истории}.
+# Сбрасывается для клиента при записи его сообщений;
+# поколение защищает от записи устаревшего результата
+HISTORY_CACHE_SIZE = 256
+_history_cache: OrderedDict[int, dict[int, list[tuple[str, str, str, str]]]] = OrderedDict()
+_history_generation = 0
+
+# Роутеры: общий (/start и кнопки), для клиентов и для админа.
+# Фильтры по ID чата админа навешиваются на роутеры в main() после загрузки настроек
 router = Router()
+client_router = Router()
+admin_router = Router()
+router.include_routers(client_router, admin_router)
 
 
 # ===== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ =====
-def get_user_info(message: Message) -> tuple[int, Optional[str], Optional[str]]:
+class UserInfo(NamedTuple):
+    """Данные отправителя вместе с готовым отображаемым именем"""
+    id: int
+    username: Optional[str]
+    full_name: Optional[str]
+    display: str
+
+
+def get_user_info(message: Message) -> UserInfo:
     """Получить информацию о пользователе"""
-    if not message.from_user:
+    user = message.from_user
+    if not user:
         raise RuntimeError("Пользователь не найден")
 
-    user = message.from_user
-    user_id = user.id
-    username = user.username
-    full_name = " ".join(filter(None, [user.first_name, user.last_name])) or None
+    first_name, last_name, username = user.first_name, user.last_name, user.username
+    if first_name and last_name:
+        full_name = first_name + " " + last_name
+    else:
+        full_name = first_name or last_name or None
+
+    display = full_name or (f"@{username}" if username else f"ID: {user.id}")
+    return UserInfo(user.id, username, full_name, display)
+
+
+async def run_db(fn: Callable[..., Any], *args: Any) -> Any:
+    """Выполнить запрос к базе в пуле потоков базы"""
+    return await asyncio.get_running_loop().run_in_executor(_db_executor, fn, *args)
+
+
+async def queue_message(
+    *,
+    user_id: int,
+    username: Optional[str],
+    full_name: Optional[str],
+    direction: str,
+    message_type: str,
+    content: Optional[str],
+    file_id: Optional[str] = None,
+) -> None:
+    """Поставить сообщение в очередь на запись в базу"""
+    await msg_queue.put(
+        (user_id, username, full_name, direction, message_type, content, file_id)
+    )
+
+
+async def save_user(user_id: int, username: Optional[str], full_name: Optional[str]) -> None:
+    """Записать клиента в базу (без сообщения), чтобы он появился в списке клиентов"""
+    await run_db(db.upsert_user, user_id, username, full_name)
+    if user_id not in _clients_by_id:
+        invalidate_clients_cache()
+
+
+async def _write_batch(batch: list[MessageRow]) -> None:
+    """Записать пачку сообщений одной транзакцией"""
+    try:
+        await run_db(db.add_messages_bulk, batch)
+    except Exception as e:
+        logger.error("Не удалось сохранить %d сообщений в базу: %s", len(batch), e)
+        return
+
+    user_ids = {row[0] for row in batch}
+
+    # Старые сообщения сверх лимита хранения удаляем
+    if settings.history_keep > 0:
+        try:
+            await run_db(db.trim_history, user_ids, settings.history_keep)
+        except Exception as e:
+            logger.error("Не удалось удалить старые сообщения: %s", e)
+
+    # Новые клиенты должны сразу появиться в списке
+    if any(user_id not in _clients_by_id for user_id in user_ids):
+        invalidate_clients_cache()
+    invalidate_history_cache(user_ids)
+
+
+async def flush_messages_loop() -> None:
+    """
+    Фоновая задача записи сообщений в базу.
+    Копит сообщения до MESSAGE_BATCH_SIZE штук или MESSAGE_FLUSH_INTERVAL секунд,
+    затем записывает их одной транзакцией. Завершается при получении None.
+    """
+    loop = asyncio.get_running_loop()
+    stopping = False
+
+    while not stopping:
+        row = await msg_queue.get()
+        if row is None:
+            break
+
+        batch = [row]
+        deadline = loop.time() + MESSAGE_FLUSH_INTERVAL
+        while len(batch) < MESSAGE_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                row = await asyncio.wait_for(msg_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if row is None:
+                stopping = True
+                break
+            batch.append(row)
+
+        await _write_batch(batch)
+
+
+def _put_admin_notice(notice: AdminNotice) -> None:
+    """Поставить уведомление админу в очередь; при переполнении отбрасывается самое старое"""
+    try:
+        admin_queue.put_nowait(notice)
+    except asyncio.QueueFull:
+        admin_queue.get_nowait()
+        admin_queue.put_nowait(notice)
+        logger.warning("Очередь уведомлений админу переполнена, старое уведомление отброшено")
+
+
+def notify_admin_text(user_id: int, display_name: str, text: str) -> None:
+    """Текст клиента: объединяется с соседними текстами того же клиента"""
+    _put_admin_notice(AdminNotice(user_id, display_name, text=text))
+
+
+def notify_admin_media(user_id: int, display_name: str, send: Callable[[], Awaitable[Any]]) -> None:
+    """Медиа клиента: отправляется сразу после уже накопленных текстов этого клиента"""
+    _put_admin_notice(AdminNotice(user_id, display_name, send=send))
 
-    return user_id, username, full_name
+
+async def _send_admin_texts(user_id: int, display_name: str, texts: list[str]) -> None:
+    """Отправить тексты одного клиента одним сообщением (или страницами)"""
+    if len(texts) == 1:
+        header = f"💬 Сообщение от {display_name}\nID: {user_id}\n"
+    else:
+        header = f"💬 Сообщения от {display_name} ({len(texts)})\nID: {user_id}\n"
+    pages = paginate(itertools.chain((header,), (text + "\n" for text in texts)), html=False)
+    try:
+        for page in pages[:-1]:
+            await bot.send_message(chat_id=settings.admin_chat_id, text=page)
+        await bot.send_message(
+            chat_id=settings.admin_chat_id,
+            text=pages[-1],
+            reply_markup=client_keyboard(user_id),
+        )
+    except Exception as e:
+        logger.error("Не удалось уведомить админа о сообщениях клиента %s: %s", user_id, e)
+
+
+async def _send_admin_batch(batch: list[AdminNotice]) -> None:
+    """Отправить накопленные уведомления, сохраняя порядок сообщений каждого клиента"""
+    grouped: dict[int, tuple[str, list[str]]] = {}
+    for notice in batch:
+        if notice.send is None:
+            entry = grouped.get(notice.user_id)
+            if entry is None:
+                grouped[notice.user_id] = (notice.display_name, [notice.text])
+            else:
+                entry[1].append(notice.text)
+            continue
+
+        # Перед медиа отправляем тексты, которые клиент написал раньше
+        entry = grouped.pop(notice.user_id, None)
+        if entry is not None:
+            await _send_admin_texts(notice.user_id, *entry)
+        try:
+            await notice.send()
+        except Exception as e:
+            logger.error("Не удалось переслать медиа клиента %s: %s", notice.user_id, e)
+
+    for user_id, (display_name, texts) in grouped.items():
+        await _send_admin_texts(user_id, display_name, texts)
+
+
+async def notify_admin_loop() -> None:
+    """
+    Фоновая задача уведомлений админа.
+    Копит текстовые сообщения клиентов до ADMIN_BATCH_SIZE штук или
+    settings.admin_batch_interval секунд и отправляет их сгруппированными
+    по клиентам. Медиа не ждёт: пачка отправляется сразу. Завершается при получении None.
+    """
+    loop = asyncio.get_running_loop()
+    stopping = False
+
+    while not stopping:
+        item = await admin_queue.get()
+        if item is None:
+            break
+
+        batch = [item]
+        deadline = loop.time() + settings.admin_batch_interval
+        while item.send is None and len(batch) < ADMIN_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(admin_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+
+        await _send_admin_batch(batch)
+
+
+async def _get_history_async(user_id: int, limit: int = 20) -> list[tuple[str, str, str, str]]:
+    """Получить историю переписки (из кэша или в пуле потоков базы)"""
+    cached = _history_cache.get(user_id)
+    if cached is not None and limit in cached:
+        _history_cache.move_to_end(user_id)
+        return cached[limit]
+
+    generation = _history_generation
+    history = await run_db(db.get_history, user_id, limit)
+    if generation == _history_generation:
+        entry = _history_cache.get(user_id)
+        if entry is None:
+            entry = _history_cache[user_id] = {}
+            if len(_history_cache) > HISTORY_CACHE_SIZE:
+                _history_cache.popitem(last=False)
+        else:
+            _history_cache.move_to_end(user_id)
+        entry[limit] = history
+    return history
+
+
+def invalidate_history_cache(user_ids: Iterable[int]) -> None:
+    """Сбросить кэш истории для указанных клиентов"""
+    global _history_generation
+    _history_generation += 1
+    for user_id in user_ids:
+        _history_cache.pop(user_id, None)
+
+
+async def cached_list_clients(
+    ttl: float = CLIENTS_CACHE_TTL,
+) -> list[tuple[int, Optional[str], Optional[str], str]]:
+    """Получить список клиентов (из кэша, если он не старше ttl секунд)"""
+    global _clients_cache, _clients_by_id, _clients_rendered
+
+    now = time.monotonic()
+    if _clients_cache is not None and now - _clients_cache[0] < ttl:
+        return _clients_cache[1]
+
+    clients = await run_db(db.list_clients, CLIENTS_LIST_LIMIT)
+    _clients_cache = (now, clients)
+    _clients_by_id = {client[0]: client for client in clients}
+    # Экранируем имена один раз при обновлении кэша, а не при каждом показе
+    _clients_rendered = [
+        (
+            user_id,
+            get_user_display_name(user_id, username, full_name),
+            f"• {get_user_display_name_html(user_id, username, full_name)}\n"
+            f"  ID: {user_id}\n"
+            f"  Последнее сообщение: {last_message}\n",
+        )
+        for user_id, username, full_name, last_message in clients
+    ]
+    return clients
 
 
+async def get_client_async(user_id: int) -> Optional[tuple[int, Optional[str], Optional[str], str]]:
+    """Получить данные одного клиента (сначала из кэша списка клиентов)"""
+    client = _clients_by_id.get(user_id)
+    if client is not None:
+        return client
+    return await run_db(db.get_client, user_id)
+
+
+def invalidate_clients_cache() -> None:
+    """Сбросить кэш списка клиентов"""
+    global _clients_cache
+    _clients_cache = None
+
+
+# Таблица экранирования для parse_mode=HTML, строится один раз
+_HTML_TRANS = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"})
+
+
+def escape_html(text: str) -> str:
+    """Экранировать текст для parse_mode=HTML"""
+    return text.translate(_HTML_TRANS)
+
+
+@lru_cache(maxsize=4096)
 def get_user_display_name(user_id: int, username: Optional[str], full_name: Optional[str]) -> str:
     """Получить отображаемое имя пользователя"""
-    if full_name:
-        return full_name
-    elif username:
-        return f"@{username}"
-    else:
-        return f"ID: {user_id}"
+    return full_name or (f"@{username}" if username else f"ID: {user_id}")
+
+
+@lru_cache(maxsize=4096)
+def get_user_display_name_html(user_id: int, username: Optional[str], full_name: Optional[str]) -> str:
+    """Получить отображаемое имя пользователя, экранированное для HTML"""
+    return escape_html(get_user_display_name(user_id, username, full_name))
+
+
+def _log_gather_errors(results: list, actions: tuple[str, ...]) -> None:
+    """Залогировать ошибки из результатов asyncio.gather(..., return_exceptions=True)"""
+    for action, result in zip(actions, results):
+        if isinstance(result, BaseException):
+            logger.error("Не удалось %s: %s", action, result)
+
+
+# Фоновые задачи (уведомления админа), которые дожидаются при остановке
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _background_task_done(action: str, task: asyncio.Task) -> None:
+    """Убрать завершённую фоновую задачу из набора и залогировать её ошибку"""
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Не удалось %s: %s", action, task.exception())
+
+
+def run_in_background(coro: Awaitable, action: str) -> None:
+    """Запустить корутину в фоне, не дожидаясь её; ошибка будет залогирована"""
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(partial(_background_task_done, action))
+
+
+# Лимит длины текста сообщения в Telegram — 4096 символов, оставляем запас.
+# Telegram считает длину в единицах UTF-16: эмодзи и прочие символы вне BMP занимают две
+PAGE_LIMIT = 3900
+
+
+def telegram_len(text: str) -> int:
+    """Длина текста так, как её считает Telegram (в единицах UTF-16)"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _utf16_prefix(text: str, limit: int) -> int:
+    """Сколько первых символов text укладывается в limit единиц UTF-16 (пара суррогатов не рвётся)"""
+    return len(text.encode("utf-16-le")[:limit * 2].decode("utf-16-le", "ignore"))
+
+
+async def _delete_message_quietly(chat_id: int, message_id: int) -> None:
+    """Удалить сообщение, игнорируя ошибки (например, если оно уже удалено)"""
+    try:
+        await bot.delete_message(chat_id=chat_id, message_id=message_id)
+    except Exception as e:
+        logger.debug("Не удалось удалить сообщение %s: %s", message_id, e)
+
+
+# Типы медиа, которым можно задать подпись при копировании, и лимит подписи
+_CAPTION_TYPES = frozenset({"photo", "document", "voice", "video"})
+CAPTION_LIMIT = 1024
+
+# Типы сообщений, которые выводятся в истории без пометки [тип]
+_TEXTUAL_TYPES = frozenset({"text", "command"})
+_AUTHORS = {"from_client": "👤 Клиент"}
+_ADMIN_AUTHOR = "👨‍💼 Вы"
+
+
+def format_history_rows(history: list[tuple[str, str, str, str]]) -> Iterator[str]:
+    """Отформатировать сообщения истории (HTML), по строке на сообщение"""
+    # Локальные ссылки вместо глобальных имён внутри цикла
+    trans = _HTML_TRANS
+    authors = _AUTHORS
+    textual = _TEXTUAL_TYPES
+    return (
+        f"{created_at}\n{authors.get(direction, _ADMIN_AUTHOR)}: "
+        f"{(content if msg_type in textual else f'[{msg_type}] {content}').translate(trans)}\n"
+        for direction, msg_type, content, created_at in history
+    )
+
+
+def _cut_point(part: str, limit: int, html: bool) -> int:
+    """Сколько первых символов part помещается в limit; в HTML сущности (&amp; и т.п.) не разрываются"""
+    cut = _utf16_prefix(part, limit)
+    if html:
+        amp = part.rfind("&", 0, cut)
+        if amp >= 0 and part.find(";", amp, cut) == -1:
+            cut = amp
+    return cut
+
+
+def paginate(parts: Iterable[str], limit: int = PAGE_LIMIT, *, html: bool = True) -> list[str]:
+    """
+    Склеить части через перевод строки в страницы не длиннее limit (в единицах UTF-16).
+    Часть длиннее страницы дополняет текущую страницу и продолжается на следующих.
+    html=False — для обычного текста, где «&» не начинает сущность
+    """
+    pages: list[str] = []
+    current: list[str] = []
+    size = 0
+
+    for part in parts:
+        part_len = telegram_len(part)
+        while True:
+            room = limit - size - 1 if current else limit
+            if part_len <= room:
+                size += part_len + 1 if current else part_len
+                current.append(part)
+                break
+            # Целиком поместится на новой странице — не режем
+            cut = 0 if part_len <= limit or room <= 0 else _cut_point(part, room, html)
+            if cut == 0 and not current:
+                cut = _utf16_prefix(part, limit)
+            if cut:
+                current.append(part[:cut])
+                part = part[cut:]
+                part_len = telegram_len(part)
+            pages.append("\n".join(current))
+            current, size = [], 0
+
+    if current:
+        pages.append("\n".join(current))
+    return pages
+
+
+async def send_history(chat_id: int, header: str, history: list[tuple[str, str, str, str]]) -> None:
+    """Отправить историю переписки, разбив её на сообщения в пределах лимита Telegram"""
+    rows = format_history_rows(history)
+    for page in paginate(itertools.chain((header + "\n",), rows)):
+        await bot.send_message(chat_id=chat_id, text=page, parse_mode=ParseMode.HTML)
+
+
+@lru_cache(maxsize=4096)
+def client_keyboard(user_id: int) -> InlineKeyboardMarkup:
+    """Кнопки "Ответить" и "История" под уведомлением о сообщении клиента"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✉️ Ответить", callback_data=f"reply:{user_id}")],
+        [InlineKeyboardButton(text="📜 История", callback_data=f"history:{user_id}")]
+    ])
+
+
+@lru_cache(maxsize=32)
+def clients_keyboard(ids_and_names: tuple[tuple[int, str], ...]) -> Optional[InlineKeyboardMarkup]:
+    """Кнопки быстрого доступа к истории для списка клиентов"""
+    if not ids_and_names:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"💬 {display_name}", callback_data=f"history:{user_id}")]
+        for user_id, display_name in ids_and_names
+    ])
+
+
+# ===== ТЕКСТЫ =====
+ADMIN_GREETING = (
+    "👋 Привет, Админ!\n\n"
+    "Доступные команды:\n"
+    "/clients - Список клиентов\n"
+    "/history <user_id> - История с клиентом\n\n"
+    "Чтобы ответить клиенту, нажмите «✉️ Ответить» под его сообщением "
+    "или просто ответьте (reply) на его сообщение."
+)
+CLIENT_GREETING = (
+    "👋 Здравствуйте!\n\n"
+    "Я бот для связи с поддержкой. Напишите ваш вопрос, "
+    "и я передам его оператору. Скоро вам ответят!"
+)
+HISTORY_USAGE = (
+    "❌ Использование: /history <user_id> [лимит]\n"
+    "Пример: /history 123456789 50"
+)
+INVALID_USER_ID = "❌ ID пользователя должен быть числом"
+NO_CLIENTS = "📋 Клиентов пока нет"
+REPLY_TARGET_UNKNOWN = "❌ Не удалось определить клиента — нажмите «✉️ Ответить» под его сообщением"
+HISTORY_EMPTY = "📜 История с клиентом {user_id}\n\nИстория пуста."
 
 
 # ===== ОБРАБОТЧИКИ КЛИЕНТСКИХ СООБЩЕНИЙ =====
@@ -108,59 +651,40 @@ async def start_command(message: Message) -> None:
     if not message.from_user or not settings or not db or not bot:
         return
 
-    user_id, username, full_name = get_user_info(message)
+    user_id, username, full_name, display_name = get_user_info(message)
 
     # Если это админ, просто приветствуем
     if message.chat.id == settings.admin_chat_id:
-        await message.answer(
-            "👋 Привет, Админ!\n\n"
-            "Доступные команды:\n"
-            "/clients - Список клиентов\n"
-            "/history <user_id> - История с клиентом"
-        )
+        await message.answer(ADMIN_GREETING)
         return
 
-    # Сохраняем в базу
-    db.add_message(
-        user_id=user_id,
-        username=username,
-        full_name=full_name,
-        direction="from_client",
-        message_type="command",
-        content="/start",
-    )
-
-    # Отвечаем клиенту
-    await message.answer(
-        "👋 Здравствуйте!\n\n"
-        "Я бот для связи с поддержкой. Напишите ваш вопрос, "
-        "и я передам его оператору. Скоро вам ответят!"
+    # Уведомление админа уходит в фоне, клиенту отвечаем сразу
+    run_in_background(
+        bot.send_message(
+            chat_id=settings.admin_chat_id,
+            text=f"🆕 Новый пользователь: {display_name} (ID: {user_id})\nОтправил команду /start",
+        ),
+        "уведомить админа",
     )
-
-    # Уведомляем админа
-    display_name = get_user_display_name(user_id, username, full_name)
-    await bot.send_message(
-        chat_id=settings.admin_chat_id,
-        text=f"🆕 Новый пользователь: {display_name} (ID: {user_id})\nОтправил команду /start",
+    # Сама команда в историю не пишется — запоминаем только клиента
+    results = await asyncio.gather(
+        save_user(user_id, username, full_name),
+        bot.send_message(chat_id=message.chat.id, text=CLIENT_GREETING),
+        return_exceptions=True,
     )
+    _log_gather_errors(results, ("сохранить клиента в базу", "ответить клиенту"))
 
 
-def is_client_message(message: Message) -> bool:
-    """Проверка, что это сообщение от клиента (не от админа)"""
-    return settings is None or message.chat.id != settings.admin_chat_id
-
-
-@router.message(
+@client_router.message(
     F.chat.type == "private",
     ~F.text.startswith("/"),
-    is_client_message
 )
 async def handle_client_message(message: Message) -> None:
     """Обработчик сообщений от клиентов"""
     if not message.from_user or not settings or not db or not bot:
         return
 
-    user_id, username, full_name = get_user_info(message)
+    user_id, username, full_name, display_name = get_user_info(message)
 
     # Определяем тип сообщения
     if message.text:
@@ -188,8 +712,12 @@ async def handle_client_message(message: Message) -> None:
         message_type = "unknown"
         file_id = None
 
-    # Сохраняем в базу
-    db.add_message(
+    # Создаем кнопки
+    keyboard = client_keyboard(user_id)
+
+    # Сообщение ставим в очередь на запись, а уведомление — в очередь для админа,
+    # чтобы обработчик не ждал ответов Telegram API
+    await queue_message(
         user_id=user_id,
         username=username,
         full_name=full_name,
@@ -198,57 +726,97 @@ async def handle_client_message(message: Message) -> None:
         content=content,
         file_id=file_id,
     )
-
-    # Формируем уведомление для админа
-    display_name = get_user_display_name(user_id, username, full_name)
-
-    # Создаем кнопки
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✉️ Ответить", callback_data=f"reply:{user_id}")],
-        [InlineKeyboardButton(text="📜 История", callback_data=f"history:{user_id}")]
-    ])
-
-    # Отправляем уведомление админу
     if message_type == "text":
-        await bot.send_message(
+        # Тексты объединяются с соседними сообщениями того же клиента
+        notify_admin_text(user_id, display_name, content)
+    elif message.media_group_id:
+        # Альбом: части приходят отдельными обновлениями, пересылаем их одним запросом
+        collect_media_group(message, user_id, display_name)
+    elif message_type in _CAPTION_TYPES:
+        # Медиа с подписью: копируем одним запросом, заголовок идёт в подпись
+        caption = f"💬 Сообщение от {display_name}\nID: {user_id}\nТип: {message_type}"
+        if content:
+            caption = f"{caption}\n\n{content}"
+        notify_admin_media(user_id, display_name, partial(
+            bot.copy_message,
             chat_id=settings.admin_chat_id,
-            text=f"💬 Сообщение от {display_name}\nID: {user_id}\n\n{content}",
+            from_chat_id=message.chat.id,
+            message_id=message.message_id,
+            caption=caption[:_utf16_prefix(caption, CAPTION_LIMIT)],
             reply_markup=keyboard,
-        )
+        ))
     else:
-        # Сначала отправляем заголовок
+        # Заголовок с кнопками, под ним само сообщение
+        notify_admin_media(user_id, display_name, partial(
+            _forward_with_header,
+            f"💬 Сообщение от {display_name}\nID: {user_id}\nТип: {message_type}",
+            user_id,
+            message.chat.id,
+            [message.message_id],
+        ))
+
+    logger.info("Получено сообщение от клиента %s (%s)", user_id, message_type)
+
+
+# Альбомы клиентов, ожидающие пересылки: media_group_id -> ID сообщений
+MEDIA_GROUP_DELAY = 0.5
+_media_groups: dict[str, list[int]] = {}
+
+
+def collect_media_group(message: Message, user_id: int, display_name: str) -> None:
+    """Добавить часть альбома; первая часть ставит весь альбом в очередь уведомлений админу"""
+    group_id = message.media_group_id
+    message_ids = _media_groups.get(group_id)
+    if message_ids is None:
+        message_ids = _media_groups[group_id] = []
+        # Альбом занимает место первой части в очереди; остальные части
+        # собираются, пока не пройдёт MEDIA_GROUP_DELAY
+        ready_at = asyncio.get_running_loop().time() + MEDIA_GROUP_DELAY
+        notify_admin_media(user_id, display_name, partial(
+            _forward_media_group, group_id, message.chat.id, user_id, display_name, ready_at,
+        ))
+    message_ids.append(message.message_id)
+
+
+async def _forward_media_group(
+    group_id: str, chat_id: int, user_id: int, display_name: str, ready_at: float,
+) -> None:
+    """Дождаться остальных частей альбома и переслать его админу одним copy_messages"""
+    await asyncio.sleep(ready_at - asyncio.get_running_loop().time())
+    message_ids = sorted(_media_groups.pop(group_id))
+    await _forward_with_header(
+        f"💬 Сообщение от {display_name}\nID: {user_id}\nАльбом: {len(message_ids)} шт.",
+        user_id,
+        chat_id,
+        message_ids,
+    )
+
+
+async def _forward_with_header(header: str, user_id: int, chat_id: int, message_ids: list[int]) -> None:
+    """Отправить админу заголовок с кнопками и скопировать под него сообщения клиента"""
+    # Если заголовок не ушёл, сообщения всё равно пересылаем
+    try:
         await bot.send_message(
             chat_id=settings.admin_chat_id,
-            text=f"💬 Сообщение от {display_name}\nID: {user_id}\nТип: {message_type}",
-            reply_markup=keyboard,
+            text=header,
+            reply_markup=client_keyboard(user_id),
         )
-
-        # Затем пересылаем само сообщение
-        try:
-            await message.copy_to(settings.admin_chat_id)
-        except Exception as e:
-            logger.error(f"Не удалось переслать медиа: {e}")
-
-    logger.info(f"Получено сообщение от клиента {user_id} ({message_type})")
+    except Exception as e:
+        logger.error("Не удалось отправить заголовок для клиента %s: %s", user_id, e)
+    await bot.copy_messages(
+        chat_id=settings.admin_chat_id,
+        from_chat_id=chat_id,
+        message_ids=message_ids,
+    )
 
 
 # ===== ОБРАБОТЧИКИ КНОПОК =====
-@router.callback_query(F.data.startswith("reply:"))
-async def button_reply(callback: CallbackQuery) -> None:
+async def button_reply(callback: CallbackQuery, user_id: int, state: FSMContext) -> None:
     """
     Обработчик нажатия кнопки "Ответить"
     Показывает приглашение написать ответ
     """
-    if not callback.data or not settings or not bot:
-        return
-
-    await callback.answer()
-
-    # Извлекаем user_id из callback_data
-    try:
-        user_id = int(callback.data.split(":")[1])
-    except (ValueError, IndexError):
-        await callback.answer("❌ Ошибка: неверный ID пользователя", show_alert=True)
+    if not settings or not bot:
         return
 
     # Убираем кнопки с исходного сообщения
@@ -267,291 +835,574 @@ async def button_reply(callback: CallbackQuery) -> None:
     )
 
     # Сохраняем информацию о том, что ждём ответ для этого клиента
-    pending_replies[settings.admin_chat_id] = prompt_msg.message_id
-    # Также сохраняем user_id в глобальном состоянии
-    global current_reply_user_id
-    current_reply_user_id = user_id
+    await state.set_state(ReplyStates.waiting_text)
+    await state.set_data({"pending": PendingReply(user_id, prompt_msg.message_id)})
 
-    logger.info(f"Админ начал отвечать клиенту {user_id}")
+    logger.info("Админ начал отвечать клиенту %s", user_id)
 
 
-@router.callback_query(F.data.startswith("history:"))
-async def button_history(callback: CallbackQuery) -> None:
+async def button_history(callback: CallbackQuery, user_id: int, state: FSMContext) -> None:
     """Обработчик нажатия кнопки "История" """
-    if not callback.data or not settings or not db or not bot:
-        return
-
-    await callback.answer()
-
-    # Извлекаем user_id из callback_data
-    try:
-        user_id = int(callback.data.split(":")[1])
-    except (ValueError, IndexError):
-        await callback.answer("❌ Ошибка: неверный ID пользователя", show_alert=True)
+    if not settings or not db or not bot:
         return
 
     # Получаем историю
-    history = db.get_history(user_id, limit=20)
+    history = await _get_history_async(user_id, limit=20)
 
     if not history:
         await bot.send_message(
             chat_id=settings.admin_chat_id,
-            text=f"📜 История с клиентом {user_id}\n\nИстория пуста.",
+            text=HISTORY_EMPTY.format(user_id=user_id),
         )
         return
 
-    # Формируем текст истории
-    lines = [f"📜 <b>История с клиентом {user_id}</b>", ""]
+    # Отправляем историю (при необходимости несколькими сообщениями)
+    await send_history(
+        settings.admin_chat_id,
+        f"📜 <b>История с клиентом {user_id}</b>",
+        history,
+    )
 
-    for direction, msg_type, content, created_at in history:
-        author = "👤 Клиент" if direction == "from_client" else "👨‍💼 Вы"
+    logger.info("Показана история для клиента %s", user_id)
 
-        if msg_type in {"text", "command"}:
-            text = content or ""
-        else:
-            text = f"[{msg_type}] {content or ''}"
 
-        lines.append(
-            f"{created_at}\n{author}: {html.escape(text)}\n"
-        )
+# Обработчики кнопок по префиксу callback_data ("<префикс>:<user_id>")
+CALLBACK_HANDLERS = {
+    "reply": button_reply,
+    "history": button_history,
+}
 
-    history_text = "\n".join(lines)
 
-    await bot.send_message(
-        chat_id=settings.admin_chat_id,
-        text=history_text,
-        parse_mode=ParseMode.HTML,
-    )
+@router.callback_query(F.data.contains(":"))
+async def dispatch_callback(callback: CallbackQuery, state: FSMContext) -> None:
+    """Разбирает callback_data один раз и передаёт управление нужной кнопке"""
+    if not callback.data:
+        return
+
+    prefix, _, payload = callback.data.partition(":")
+    handler = CALLBACK_HANDLERS.get(prefix)
+    if handler is None:
+        return
+
+    # Извлекаем user_id из callback_data
+    try:
+        user_id = int(payload)
+    except ValueError:
+        await callback.answer("❌ Ошибка: неверный ID пользователя", show_alert=True)
+        return
 
-    logger.info(f"Показана история для клиента {user_id}")
+    await callback.answer()
+    await handler(callback, user_id, state)
 
 
 # ===== ОБРАБОТЧИКИ СООБЩЕНИЙ АДМИНА =====
-current_reply_user_id: Optional[int] = None
+async def _send_to_client(message: Message, user_id: int) -> bool:
+    """Отправить текст админа клиенту; при ошибке сообщить админу и вернуть False"""
+    try:
+        await bot.send_message(chat_id=user_id, text=message.text)
+    except Exception as e:
+        logger.error("Ошибка отправки сообщения клиенту: %s", e)
+        await message.answer(
+            f"❌ Ошибка отправки сообщения: {e}"
+        )
+        return False
+    return True
 
 
-def is_admin_chat(message: Message) -> bool:
-    """Проверка, что сообщение от админа"""
-    return settings is not None and message.chat.id == settings.admin_chat_id
+# Действия после доставки ответа — для логирования ошибок gather
+_REPLY_FOLLOWUP_ACTIONS = ("сохранить сообщение в базу", "подтвердить отправку")
 
 
-@router.message(
-    is_admin_chat,
+def _reply_followups(message: Message, user_id: int) -> list[Awaitable]:
+    """Сохранение ответа в базу и подтверждение админу"""
+    return [
+        queue_message(
+            user_id=user_id,
+            username=None,
+            full_name=None,
+            direction="from_admin",
+            message_type="text",
+            content=message.text,
+        ),
+        bot.send_message(
+            chat_id=message.chat.id,
+            text=f"✅ Сообщение отправлено клиенту {user_id}",
+        ),
+    ]
+
+
+def is_reply_to_bot(message: Message) -> bool:
+    """Админ ответил (reply) на сообщение бота, а не коллеги в чате"""
+    quoted = message.reply_to_message
+    return quoted is not None and quoted.from_user is not None and quoted.from_user.id == bot.id
+
+
+def _reply_target(message: Message) -> Optional[int]:
+    """ID клиента из кнопки "Ответить" под сообщением бота, на которое ответил админ"""
+    if not is_reply_to_bot(message):
+        return None
+    markup = message.reply_to_message.reply_markup
+    if markup is None:
+        return None
+    for row in markup.inline_keyboard:
+        for button in row:
+            prefix, _, payload = (button.callback_data or "").partition(":")
+            if prefix == "reply" and payload.isdigit():
+                return int(payload)
+    return None
+
+
+@admin_router.message(
+    StateFilter(ReplyStates.waiting_text),
     F.text,
     ~F.text.startswith("/")
 )
-async def handle_admin_message(message: Message) -> None:
-    """Обработчик текстовых сообщений от админа (ответы клиентам)"""
-    if not settings or not db or not bot:
+async def handle_admin_message(message: Message, state: FSMContext) -> None:
+    """
+    Обработчик текстовых сообщений от админа (ответы клиентам)
+    Вызывается только в состоянии ReplyStates.waiting_text и только для текста
+    """
+    if not settings or not bot:
         return
 
-    global current_reply_user_id
-
-    # Проверяем, есть ли ожидающий ответ
-    if settings.admin_chat_id not in pending_replies or current_reply_user_id is None:
+    # Получаем клиента, которому ждём ответ
+    pending: Optional[PendingReply] = (await state.get_data()).get("pending")
+    if pending is None:
         return
+    user_id = pending.user_id
 
-    user_id = current_reply_user_id
-    prompt_message_id = pending_replies[settings.admin_chat_id]
+    # Reply на уведомление другого клиента адресован ему, а не ожидающему ответа
+    quoted_user_id = _reply_target(message)
+    if quoted_user_id is not None and quoted_user_id != user_id:
+        await _send_quote_reply(message, quoted_user_id)
+        return
 
-    # Получаем текст ответа
-    reply_text = message.text
-    if not reply_text:
-        await message.answer("❌ Ответ должен содержать текст")
+    if not await _send_to_client(message, user_id):
         return
 
-    try:
-        # Отправляем сообщение клиенту
-        await bot.send_message(
-            chat_id=user_id,
-            text=reply_text,
-        )
+    # Сохраняем в базу, подтверждаем отправку, удаляем приглашение
+    # и очищаем состояние одновременно
+    results = await asyncio.gather(
+        *_reply_followups(message, user_id),
+        _delete_message_quietly(settings.admin_chat_id, pending.prompt_message_id),
+        state.clear(),
+        return_exceptions=True,
+    )
+    _log_gather_errors(
+        results,
+        _REPLY_FOLLOWUP_ACTIONS + ("удалить приглашение", "очистить состояние"),
+    )
 
-        # Сохраняем в базу
-        db.add_message(
-            user_id=user_id,
-            username=None,
-            full_name=None,
-            direction="from_admin",
-            message_type="text",
-            content=reply_text,
-        )
+    logger.info("Админ отправил ответ клиенту %s", user_id)
 
-        # Удаляем приглашающее сообщение
-        try:
-            await bot.delete_message(
-                chat_id=settings.admin_chat_id,
-                message_id=prompt_message_id,
-            )
-        except Exception as e:
-            logger.debug(f"Не удалось удалить приглашение: {e}")
 
-        # Показываем подтверждение
-        await message.answer(
-            f"✅ Сообщение отправлено клиенту {user_id}"
-        )
+async def _send_quote_reply(message: Message, user_id: int) -> None:
+    """Доставить клиенту ответ, данный через reply на его уведомление"""
+    if not await _send_to_client(message, user_id):
+        return
 
-        # Очищаем состояние
-        del pending_replies[settings.admin_chat_id]
-        current_reply_user_id = None
+    results = await asyncio.gather(*_reply_followups(message, user_id), return_exceptions=True)
+    _log_gather_errors(results, _REPLY_FOLLOWUP_ACTIONS)
 
-        logger.info(f"Админ отправил ответ клиенту {user_id}")
+    logger.info("Админ ответил клиенту %s через reply", user_id)
 
-    except Exception as e:
-        logger.error(f"Ошибка отправки сообщения клиенту: {e}")
-        await message.answer(
-            f"❌ Ошибка отправки сообщения: {e}"
-        )
+
+@admin_router.message(
+    is_reply_to_bot,
+    F.text,
+    ~F.text.startswith("/")
+)
+async def handle_admin_quote_reply(message: Message) -> None:
+    """
+    Ответ админа через «Ответить» (reply) на уведомление о сообщении клиента.
+    Клиент определяется по кнопке под уведомлением, без приглашения и состояния
+    """
+    if not settings or not bot:
+        return
+
+    user_id = _reply_target(message)
+    if user_id is None:
+        # Reply на сообщение бота без кнопки «Ответить» — не молчим, а подсказываем
+        await message.answer(REPLY_TARGET_UNKNOWN)
+        return
+
+    await _send_quote_reply(message, user_id)
 
 
 # ===== КОМАНДЫ АДМИНА =====
-@router.message(
-    Command("clients"),
-    is_admin_chat
-)
+@admin_router.message(Command("clients"))
 async def clients_command(message: Message) -> None:
     """Команда /clients - показать список клиентов"""
     if not settings or not db:
         return
 
-    clients = db.list_clients()
+    clients = await cached_list_clients()
 
     if not clients:
-        await message.answer("📋 Клиентов пока нет")
+        await message.answer(NO_CLIENTS)
         return
 
-    # Формируем список клиентов
-    lines = ["👥 <b>Список клиентов:</b>\n"]
-    keyboard = []
-
-    for user_id, username, full_name, last_message in clients[:20]:
-        display_name = get_user_display_name(user_id, username, full_name)
-        lines.append(
-            f"• {html.escape(display_name)}\n"
-            f"  ID: {user_id}\n"
-            f"  Последнее сообщение: {last_message}\n"
-        )
-
-        # Добавляем кнопки для быстрого доступа
-        keyboard.append([
-            InlineKeyboardButton(
-                text=f"💬 {display_name}",
-                callback_data=f"history:{user_id}"
-            )
-        ])
-
-    reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard) if keyboard else None
-
+    # Формируем список клиентов из заранее подготовленных строк;
+    # длинные имена могут не влезть в одно сообщение, поэтому делим на страницы
+    shown = _clients_rendered
+    pages = paginate(itertools.chain(
+        ("👥 <b>Список клиентов:</b>\n",),
+        (entry for _, _, entry in shown),
+    ))
+
+    # Добавляем кнопки для быстрого доступа под последней страницей
+    reply_markup = clients_keyboard(tuple(
+        (user_id, display_name) for user_id, display_name, _ in shown
+    ))
+
+    for page in pages[:-1]:
+        await message.answer(page, parse_mode=ParseMode.HTML)
     await message.answer(
-        "\n".join(lines),
+        pages[-1],
         parse_mode=ParseMode.HTML,
         reply_markup=reply_markup,
     )
 
-    logger.info(f"Показан список из {len(clients)} клиентов")
+    logger.info("Показан список из %d клиентов", len(clients))
 
 
-@router.message(
-    Command("history"),
-    is_admin_chat
-)
-async def history_command(message: Message) -> None:
+@admin_router.message(Command("history"))
+async def history_command(message: Message, command: CommandObject) -> None:
     """Команда /history <user_id> - показать историю с клиентом"""
-    if not settings or not db or not message.text:
+    if not settings or not db:
         return
 
-    # Парсим аргументы из текста команды
-    parts = message.text.split()
+    # Аргументы команды уже выделены фильтром Command
+    args = (command.args or "").split()
 
     # Проверяем аргументы
-    if len(parts) < 2:
-        await message.answer(
-            "❌ Использование: /history <user_id> [лимит]\n"
-            "Пример: /history 123456789 50"
-        )
+    if not args:
+        await message.answer(HISTORY_USAGE)
         return
 
     try:
-        user_id = int(parts[1])
+        user_id = int(args[0])
     except ValueError:
-        await message.answer("❌ ID пользователя должен быть числом")
+        await message.answer(INVALID_USER_ID)
         return
 
     # Получаем лимит (по умолчанию 20)
     limit = 20
-    if len(parts) >= 3:
+    if len(args) >= 2:
         try:
-            limit = max(1, min(100, int(parts[2])))
+            limit = max(1, min(100, int(args[1])))
         except ValueError:
             pass
 
-    # Получаем историю
-    history = db.get_history(user_id, limit)
+    # История и имя клиента для заголовка запрашиваются одновременно
+    # (для неизвестного клиента история просто пуста)
+    client, history = await asyncio.gather(
+        get_client_async(user_id),
+        _get_history_async(user_id, limit),
+    )
 
     if not history:
-        await message.answer(
-            f"📜 История с клиентом {user_id}\n\nИстория пуста."
-        )
+        await message.answer(HISTORY_EMPTY.format(user_id=user_id))
         return
 
-    # Формируем текст истории
-    lines = [f"📜 <b>История с клиентом {user_id}</b> (последние {len(history)})", ""]
+    if client is not None:
+        title = f"{get_user_display_name_html(*client[:3])}</b> (ID: {user_id}, последние {len(history)})"
+    else:
+        title = f"{user_id}</b> (последние {len(history)})"
 
-    for direction, msg_type, content, created_at in history:
-        author = "👤 Клиент" if direction == "from_client" else "👨‍💼 Вы"
+    # Отправляем историю (при необходимости несколькими сообщениями)
+    await send_history(message.chat.id, f"📜 <b>История с клиентом {title}", history)
 
-        if msg_type in {"text", "command"}:
-            text = content or ""
-        else:
-            text = f"[{msg_type}] {content or ''}"
+    logger.info("Показана история для клиента %s (%d сообщений)", user_id, len(history))
 
-        lines.append(
-            f"{created_at}\n{author}: {html.escape(text)}\n"
-        )
 
-    history_text = "\n".join(lines)
+# ===== HTTP-СЕССИЯ =====
+class ChatOrderMiddleware(BaseMiddleware):
+    """
+    Обновления одного чата обрабатываются строго по очереди,
+    обновления разных чатов — параллельно
+    """
 
-    await message.answer(
-        history_text,
-        parse_mode=ParseMode.HTML,
+    def __init__(self) -> None:
+        # chat_id -> [замок, число ожидающих и выполняющихся обновлений]
+        self._locks: dict[int, list] = {}
+        # Число обновлений в обработке; событие установлено, когда их нет
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def wait_idle(self) -> None:
+        """Дождаться завершения всех обновлений, которые уже начали обрабатываться"""
+        # Задачи обновлений, созданные перед остановкой, успевают дойти до middleware
+        await asyncio.sleep(0)
+        await self._idle.wait()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            return await self._handle(handler, event, data)
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+    async def _handle(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        chat = data.get("event_chat")
+        if chat is None:
+            return await handler(event, data)
+
+        entry = self._locks.get(chat.id)
+        if entry is None:
+            entry = self._locks[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await handler(event, data)
+        finally:
+            # Замок больше никому не нужен — удаляем, чтобы словарь не рос
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[chat.id]
+
+
+# Лимиты Telegram: ~30 сообщений/с всего и 20 сообщений/мин в одну группу
+OVERALL_MAX_RATE = 25
+OVERALL_TIME_PERIOD = 1.0
+GROUP_MAX_RATE = 18
+GROUP_TIME_PERIOD = 60.0
+# Сколько групповых чатов помнить; самые давно неактивные вытесняются
+GROUP_LIMITERS_SIZE = 1000
+
+# Размер пула keep-alive соединений к api.telegram.org
+HTTP_POOL_LIMIT = 100
+
+
+class RateLimiter:
+    """Скользящее окно: не более max_rate вызовов за period секунд"""
+
+    __slots__ = ("max_rate", "period", "_calls", "_lock")
+
+    def __init__(self, max_rate: int, period: float) -> None:
+        self.max_rate = max_rate
+        self.period = period
+        self._calls: deque[float] = deque()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Дождаться свободного места в окне и занять его"""
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            calls = self._calls
+            while True:
+                now = loop.time()
+                while calls and calls[0] <= now - self.period:
+                    calls.popleft()
+                if len(calls) < self.max_rate:
+                    break
+                await asyncio.sleep(calls[0] + self.period - now)
+            calls.append(now)
+
+
+class TunedAiohttpSession(AiohttpSession):
+    """
+    Общая HTTP-сессия для всех запросов к Bot API
+    с увеличенным пулом keep-alive соединений
+    и ограничением частоты исходящих сообщений, чтобы не получать 429
+    """
+
+    def __init__(self, **kwargs) -> None:
+        kwargs.setdefault("timeout", 15)
+        kwargs.setdefault("limit", HTTP_POOL_LIMIT)
+        super().__init__(**kwargs)
+        self._overall_limiter = RateLimiter(OVERALL_MAX_RATE, OVERALL_TIME_PERIOD)
+        self._group_limiters: OrderedDict[int, RateLimiter] = OrderedDict()
+
+    async def _throttle(self, chat_id: int) -> None:
+        """Подождать, если лимит для чата или общий лимит исчерпан"""
+        if chat_id < 0:
+            limiters = self._group_limiters
+            limiter = limiters.get(chat_id)
+            if limiter is None:
+                limiter = limiters[chat_id] = RateLimiter(GROUP_MAX_RATE, GROUP_TIME_PERIOD)
+                if len(limiters) > GROUP_LIMITERS_SIZE:
+                    limiters.popitem(last=False)
+            else:
+                limiters.move_to_end(chat_id)
+            await limiter.acquire()
+        await self._overall_limiter.acquire()
+
+    async def make_request(self, bot: Bot, method, timeout: Optional[int] = None):
+        # Ограничиваем только запросы, адресованные чату (отправка, копирование и т.п.)
+        chat_id = getattr(method, "chat_id", None)
+        if not isinstance(chat_id, int):
+            return await super().make_request(bot, method, timeout)
+
+        await self._throttle(chat_id)
+        try:
+            return await super().make_request(bot, method, timeout)
+        except TelegramRetryAfter as e:
+            # Telegram всё же ответил 429 — ждём указанное время и повторяем один раз
+            logger.warning("Превышен лимит Telegram, повтор через %s с", e.retry_after)
+            await asyncio.sleep(e.retry_after)
+            return await super().make_request(bot, method, timeout)
+
+
+# ===== ЗАПУСК =====
+POLLING_TIMEOUT = 30
+STOP_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+
+
+async def run_polling(dp: Dispatcher) -> None:
+    """Получение обновлений через long polling"""
+    # Пока зарегистрирован webhook (после запуска в режиме webhook), getUpdates
+    # возвращает Conflict. Накопившиеся обновления не отбрасываем
+    await bot.delete_webhook(drop_pending_updates=False)
+    # Telegram держит запрос открытым до POLLING_TIMEOUT секунд, пока нет новых обновлений.
+    # Каждое обновление обрабатывается отдельной задачей, чтобы медленный клиент
+    # не задерживал остальных
+    await dp.start_polling(
+        bot,
+        polling_timeout=POLLING_TIMEOUT,
+        handle_as_tasks=True,
+        # Сессию закрывает main() после отправки оставшихся уведомлений
+        close_bot_session=False,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+
+
+class WebhookRequestHandler(SimpleRequestHandler):
+    """Обработчик webhook, который не закрывает сессию бота при остановке сервера"""
+
+    async def close(self) -> None:
+        # Сессию закрывает main() после отправки оставшихся уведомлений
+        pass
+
+
+async def run_webhook(dp: Dispatcher) -> None:
+    """Получение обновлений через webhook: Telegram сам присылает их на наш HTTP-сервер"""
+    app = web.Application()
+    WebhookRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=settings.webhook_secret,
+    ).register(app, path=settings.webhook_path)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, settings.webhook_host, settings.webhook_port)
+    await site.start()
+    logger.info(
+        "🌐 Webhook слушает %s:%s%s",
+        settings.webhook_host, settings.webhook_port, settings.webhook_path,
     )
 
-    logger.info(f"Показана история для клиента {user_id} ({len(history)} сообщений)")
+    # Работаем до SIGINT/SIGTERM, затем корректно останавливаем сервер
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in STOP_SIGNALS:
+        with suppress(NotImplementedError):  # Windows
+            loop.add_signal_handler(sig, stop.set)
+
+    try:
+        # Регистрируем webhook только когда сервер уже принимает запросы:
+        # иначе первые обновления Telegram получат отказ в соединении
+        await bot.set_webhook(
+            url=settings.webhook_url.rstrip("/") + settings.webhook_path,
+            secret_token=settings.webhook_secret,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        await stop.wait()
+        logger.info("Получен сигнал остановки")
+    finally:
+        for sig in STOP_SIGNALS:
+            with suppress(NotImplementedError):
+                loop.remove_signal_handler(sig)
+        await runner.cleanup()
 
 
 # ===== ГЛАВНАЯ ФУНКЦИЯ =====
 async def main() -> None:
     """Главная функция запуска бота"""
-    global settings, db, bot
+    global settings, db, bot, admin_queue
 
     # Загружаем настройки
     settings = Settings.load()
 
     # Инициализируем базу данных
-    db = Database(settings.database_path)
+    db = Database(settings.database_path, readers=DB_WORKERS)
 
     logger.info("✅ Настройки загружены")
-    logger.info(f"✅ База данных: {settings.database_path}")
-    logger.info(f"✅ Админ ID: {settings.admin_chat_id}")
+    logger.info("✅ База данных: %s", settings.database_path)
+    logger.info("✅ Админ ID: %s", settings.admin_chat_id)
 
     # Создаем бота и диспетчер
-    bot = Bot(token=settings.token)
-    dp = Dispatcher()
+    bot = Bot(token=settings.token, session=TunedAiohttpSession())
+    dp = Dispatcher(storage=MemoryStorage())
 
-    # Регистрируем роутер
+    # Разделяем сообщения админа и клиентов по ID чата
+    admin_router.message.filter(F.chat.id == settings.admin_chat_id)
+    client_router.message.filter(F.chat.id != settings.admin_chat_id)
+
+    # Регистрируем роутер; сообщения одного чата обрабатываются по порядку
+    chat_order = ChatOrderMiddleware()
+    dp.update.outer_middleware(chat_order)
     dp.include_router(router)
 
+    # Запускаем фоновую запись сообщений в базу и отправку уведомлений админу
+    admin_queue = asyncio.Queue(maxsize=settings.admin_buffer_size)
+    flush_task = asyncio.create_task(flush_messages_loop())
+    notify_task = asyncio.create_task(notify_admin_loop())
+
     # Запускаем бота
     logger.info("🚀 Бот запущен и готов к работе!")
 
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if settings.webhook_url:
+            await run_webhook(dp)
+        else:
+            await run_polling(dp)
     finally:
+        # Новые обновления уже не поступают: дожидаемся тех, что ещё обрабатываются
+        # (polling и webhook запускают их отдельными задачами), затем фоновых
+        # уведомлений, и только после этого дописываем накопленные сообщения
+        await chat_order.wait_idle()
+        if _background_tasks:
+            await asyncio.gather(*_background_tasks, return_exceptions=True)
+        await admin_queue.put(None)
+        await msg_queue.put(None)
+        await asyncio.gather(notify_task, flush_task)
+        _db_executor.shutdown(wait=True)
+        db.close()
         await bot.session.close()
 
 
 if __name__ == "__main__":
+    # uvloop — более быстрая реализация event loop (недоступна на Windows)
+    try:
+        import uvloop
+    except ImportError:
+        pass
+    else:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    log_listener.start()
     try:
         asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
         logger.info("👋 Бот остановлен")
+    finally:
+        log_listener.stop()
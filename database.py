@@ -1,50 +1,228 @@
 from __future__ import annotations
 
+import queue
 import sqlite3
-from contextlib import contextmanager
+import threading
 from pathlib import Path
 from typing import Iterable, List, Optional, Tuple
 
+# (user_id, username, full_name, direction, message_type, content, file_id)
+MessageRow = Tuple[int, Optional[str], Optional[str], str, str, Optional[str], Optional[str]]
+
+# Хватает на все разные запросы бота, поэтому ни один не компилируется повторно
+_STATEMENT_CACHE_SIZE = 256
+
+# Настройки каждого соединения: в режиме WAL synchronous=NORMAL безопасен, и коммит обходится без лишнего fsync
+_CONNECTION_PRAGMAS = """
+PRAGMA synchronous = NORMAL;
+PRAGMA temp_store = MEMORY;
+PRAGMA mmap_size = 268435456;
+PRAGMA cache_size = -64000;
+PRAGMA busy_timeout = 5000;
+"""
+
+# Один текст запроса для всех вставок, чтобы кэш запросов sqlite3 переиспользовал скомпилированную форму
+_INSERT_MESSAGE_SQL = """
+INSERT INTO messages (
+    user_id, username, full_name, direction, message_type, content, file_id
+) VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+# Увеличивается, когда существующим базам нужна разовая миграция (хранится в PRAGMA user_version)
+_SCHEMA_VERSION = 1
+
+# Вся схема одним скриптом. История читается по id от новых к старым; старый индекс
+# (user_id, created_at) больше никто не читает, он только замедляет вставки.
+# Время хранится целыми unix-секундами (strftime работает и до SQLite 3.38 с её unixepoch())
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    full_name TEXT,
+    direction TEXT NOT NULL,
+    message_type TEXT NOT NULL,
+    content TEXT,
+    file_id TEXT,
+    created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+);
+CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages(user_id, id);
+DROP INDEX IF EXISTS idx_messages_user;
+
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    full_name TEXT,
+    first_seen INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+    last_seen INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+);
+CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users(last_seen);
+"""
+
+# Версия 0 -> 1: текстовые столбцы CURRENT_TIMESTAMP становятся unix-секундами. Старые таблицы
+# переименовываются (их индексы удаляются, чтобы освободить имена), _SCHEMA_SQL создаёт
+# их заново, и строки копируются обратно
+_LEGACY_TIMESTAMP_TABLES = {
+    "messages": """
+        INSERT INTO messages (
+            id, user_id, username, full_name, direction, message_type, content, file_id, created_at
+        )
+        SELECT
+            id, user_id, username, full_name, direction, message_type, content, file_id,
+            CAST(strftime('%s', created_at) AS INTEGER)
+        FROM legacy_messages;
+    """,
+    "users": """
+        INSERT INTO users (user_id, username, full_name, first_seen, last_seen)
+        SELECT
+            user_id, username, full_name,
+            CAST(strftime('%s', first_seen) AS INTEGER),
+            CAST(strftime('%s', last_seen) AS INTEGER)
+        FROM legacy_users;
+    """,
+}
+
+# Одна строка на клиента; пустые имена не затирают уже известные
+_UPSERT_USER_SQL = """
+INSERT INTO users (user_id, username, full_name) VALUES (?, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+    username = COALESCE(NULLIF(excluded.username, ''), users.username),
+    full_name = COALESCE(NULLIF(excluded.full_name, ''), users.full_name),
+    last_seen = CAST(strftime('%s', 'now') AS INTEGER)
+"""
+
+# Разовое заполнение `users` для баз, созданных до появления этой таблицы
+_BACKFILL_USERS_SQL = """
+INSERT OR IGNORE INTO users (user_id, username, full_name, first_seen, last_seen)
+SELECT
+    m.user_id,
+    (
+        SELECT username
+        FROM messages m2
+        WHERE m2.user_id = m.user_id
+            AND m2.username IS NOT NULL
+            AND m2.username <> ''
+        ORDER BY m2.created_at DESC
+        LIMIT 1
+    ),
+    (
+        SELECT full_name
+        FROM messages m3
+        WHERE m3.user_id = m.user_id
+            AND m3.full_name IS NOT NULL
+            AND m3.full_name <> ''
+        ORDER BY m3.created_at DESC
+        LIMIT 1
+    ),
+    MIN(m.created_at),
+    MAX(m.created_at)
+FROM messages m
+GROUP BY m.user_id
+"""
+
+# Оставить у каждого клиента только `keep` последних сообщений, более старые удалить
+_TRIM_HISTORY_SQL = """
+DELETE FROM messages
+WHERE user_id = :user_id AND id <= (
+    SELECT id FROM messages
+    WHERE user_id = :user_id
+    ORDER BY id DESC
+    LIMIT 1 OFFSET :keep
+)
+"""
+
+_LIST_CLIENTS_SQL = """
+SELECT user_id, username, full_name, datetime(last_seen, 'unixepoch')
+FROM users
+ORDER BY last_seen DESC
+LIMIT ?
+"""
+
+_GET_CLIENT_SQL = """
+SELECT user_id, username, full_name, datetime(last_seen, 'unixepoch')
+FROM users
+WHERE user_id = :user_id
+"""
+
+# Последние `limit` сообщений по id, возвращаются от старых к новым
+_GET_HISTORY_SQL = """
+SELECT direction, message_type, body, datetime(created_at, 'unixepoch')
+FROM (
+    SELECT id, direction, message_type,
+        COALESCE(content, file_id, '') AS body, created_at
+    FROM messages
+    WHERE user_id = ?
+    ORDER BY id DESC
+    LIMIT ?
+)
+ORDER BY id
+"""
+
 
 class Database:
-    def __init__(self, path: Path | str = "data/bot.db") -> None:
+    """Хранилище SQLite: одно соединение-писатель под блокировкой и пул читателей.
+
+    Соединения используются из разных рабочих потоков; WAL позволяет читать во время записи.
+    """
+
+    def __init__(self, path: Path | str = "data/bot.db", readers: int = 4) -> None:
         self.path = Path(path)
         if not self.path.parent.exists():
             self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._write_lock = threading.Lock()
+        self._writer = self._connect()
         self._init_db()
+        self._readers: queue.Queue[sqlite3.Connection] = queue.Queue()
+        for _ in range(readers):
+            self._readers.put(self._connect())
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path, check_same_thread=False, cached_statements=_STATEMENT_CACHE_SIZE
+        )
+        conn.executescript(_CONNECTION_PRAGMAS)
+        return conn
+
+    def close(self) -> None:
+        with self._write_lock:
+            self._writer.close()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
 
     def _init_db(self) -> None:
-        with self._get_connection() as conn:
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    username TEXT,
-                    full_name TEXT,
-                    direction TEXT NOT NULL,
-                    message_type TEXT NOT NULL,
-                    content TEXT,
-                    file_id TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-                """
-            )
-            conn.execute(
-                """
-                CREATE INDEX IF NOT EXISTS idx_messages_user
-                ON messages(user_id, created_at)
-                """
-            )
+        with self._write_lock, self._writer as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+                self._migrate(conn)
+            else:
+                conn.executescript(_SCHEMA_SQL)
+            if conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None:
+                conn.execute(_BACKFILL_USERS_SQL)
 
-    @contextmanager
-    def _get_connection(self) -> Iterable[sqlite3.Connection]:
-        conn = sqlite3.connect(self.path)
-        try:
-            yield conn
-            conn.commit()
-        finally:
-            conn.close()
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection) -> None:
+        # Один скрипт в одной транзакции: при ошибке старые таблицы остаются как были
+        legacy = [
+            name
+            for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('messages', 'users')"
+            )
+        ]
+        script = [
+            "BEGIN;",
+            "DROP INDEX IF EXISTS idx_messages_user;",
+            "DROP INDEX IF EXISTS idx_messages_user_id;",
+            "DROP INDEX IF EXISTS idx_users_last_seen;",
+        ]
+        script.extend(f"ALTER TABLE {name} RENAME TO legacy_{name};" for name in legacy)
+        script.append(_SCHEMA_SQL)
+        for name in legacy:
+            script.append(_LEGACY_TIMESTAMP_TABLES[name])
+            script.append(f"DROP TABLE legacy_{name};")
+        script.append(f"PRAGMA user_version = {_SCHEMA_VERSION};")
+        script.append("COMMIT;")
+        conn.executescript("\n".join(script))
 
     def add_message(
         self,
@@ -57,65 +235,47 @@ class Database:
         content: Optional[str],
         file_id: Optional[str] = None,
     ) -> None:
-        with self._get_connection() as conn:
+        with self._write_lock, self._writer as conn:
             conn.execute(
-                """
-                INSERT INTO messages (
-                    user_id, username, full_name, direction, message_type, content, file_id
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-                """,
+                _INSERT_MESSAGE_SQL,
                 (user_id, username, full_name, direction, message_type, content, file_id),
             )
+            conn.execute(_UPSERT_USER_SQL, (user_id, username, full_name))
+
+    def add_messages_bulk(self, rows: Iterable[MessageRow]) -> None:
+        rows = list(rows)
+        with self._write_lock, self._writer as conn:
+            conn.executemany(_INSERT_MESSAGE_SQL, rows)
+            conn.executemany(_UPSERT_USER_SQL, [row[:3] for row in rows])
+
+    def upsert_user(self, user_id: int, username: Optional[str], full_name: Optional[str]) -> None:
+        with self._write_lock, self._writer as conn:
+            conn.execute(_UPSERT_USER_SQL, (user_id, username, full_name))
 
-    def list_clients(self) -> List[Tuple[int, Optional[str], Optional[str], str]]:
-        query = (
-            """
-            WITH latest AS (
-                SELECT user_id, MAX(created_at) AS last_message
-                FROM messages
-                GROUP BY user_id
+    def trim_history(self, user_ids: Iterable[int], keep: int) -> None:
+        with self._write_lock, self._writer as conn:
+            conn.executemany(
+                _TRIM_HISTORY_SQL,
+                ({"user_id": user_id, "keep": keep} for user_id in user_ids),
             )
-            SELECT
-                latest.user_id,
-                (
-                    SELECT username
-                    FROM messages m2
-                    WHERE m2.user_id = latest.user_id
-                        AND m2.username IS NOT NULL
-                        AND m2.username <> ''
-                    ORDER BY m2.created_at DESC
-                    LIMIT 1
-                ) AS username,
-                (
-                    SELECT full_name
-                    FROM messages m3
-                    WHERE m3.user_id = latest.user_id
-                        AND m3.full_name IS NOT NULL
-                        AND m3.full_name <> ''
-                    ORDER BY m3.created_at DESC
-                    LIMIT 1
-                ) AS full_name,
-                latest.last_message
-            FROM latest
-            ORDER BY latest.last_message DESC
-            """
-        )
-        with self._get_connection() as conn:
-            cur = conn.execute(query)
-            return [(row[0], row[1], row[2], row[3]) for row in cur.fetchall()]
+
+    def list_clients(self, limit: int = 20) -> List[Tuple[int, Optional[str], Optional[str], str]]:
+        conn = self._readers.get()
+        try:
+            return conn.execute(_LIST_CLIENTS_SQL, (limit,)).fetchall()
+        finally:
+            self._readers.put(conn)
+
+    def get_client(self, user_id: int) -> Optional[Tuple[int, Optional[str], Optional[str], str]]:
+        conn = self._readers.get()
+        try:
+            return conn.execute(_GET_CLIENT_SQL, {"user_id": user_id}).fetchone()
+        finally:
+            self._readers.put(conn)
 
     def get_history(self, user_id: int, limit: int = 20) -> List[Tuple[str, str, str, str]]:
-        query = (
-            """
-            SELECT direction, message_type, COALESCE(content, file_id) as body, created_at
-            FROM messages
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-            LIMIT ?
-            """
-        )
-        with self._get_connection() as conn:
-            cur = conn.execute(query, (user_id, limit))
-            rows = cur.fetchall()
-            rows.reverse()
-            return [(row[0], row[1], row[2] or "", row[3]) for row in rows]
+        conn = self._readers.get()
+        try:
+            return conn.execute(_GET_HISTORY_SQL, (user_id, limit)).fetchall()
+        finally:
+            self._readers.put(conn)
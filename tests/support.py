@@ -0,0 +1,66 @@
+"""Общая обвязка тестов: бот с фейковой сессией Bot API и временной базой"""
+
+import datetime
+import sys
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aiogram import Dispatcher, F
+from aiogram.client.session.base import BaseSession
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Message
+
+import bot as B
+from database import Database
+
+ADMIN = 1000
+BOT_ID = 42
+
+_dispatcher: Optional[Dispatcher] = None
+
+
+class FakeSession(BaseSession):
+    """Сессия без сети: запоминает вызванные методы Bot API"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls = []
+        self._message_id = 500
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls.append(method)
+        if type(method).__name__ == "SendMessage":
+            self._message_id += 1
+            return Message(
+                message_id=self._message_id,
+                date=datetime.datetime.now(),
+                chat={"id": method.chat_id, "type": "private"},
+                text=method.text,
+            )
+        return True
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+
+def configure() -> Dispatcher:
+    """Настроить модуль bot как в main() (один раз на процесс) и вернуть диспетчер"""
+    global _dispatcher
+    if _dispatcher is None:
+        B.settings = B.Settings(
+            token=f"{BOT_ID}:TEST",
+            admin_chat_id=ADMIN,
+            database_path=str(Path(tempfile.mkdtemp()) / "bot.db"),
+        )
+        B.db = Database(B.settings.database_path)
+        B.admin_router.message.filter(F.chat.id == ADMIN)
+        B.client_router.message.filter(F.chat.id != ADMIN)
+        _dispatcher = Dispatcher(storage=MemoryStorage())
+        _dispatcher.include_router(B.router)
+    return _dispatcher
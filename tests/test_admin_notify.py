@@ -0,0 +1,65 @@
+"""Порядок уведомлений админу: тексты из пачки и медиа одного клиента"""
+
+import asyncio
+import unittest
+from functools import partial
+
+from aiogram import Bot
+
+from support import ADMIN, FakeSession, configure
+
+import bot as B
+
+CLIENT = 111
+
+
+def setUpModule() -> None:
+    configure()
+
+
+class AdminNotifyOrderTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.session = FakeSession()
+        B.bot = Bot(token=B.settings.token, session=self.session)
+        B.admin_queue = asyncio.Queue()
+        self.loop_task = asyncio.create_task(B.notify_admin_loop())
+
+    async def stop_loop(self) -> None:
+        await B.admin_queue.put(None)
+        await self.loop_task
+
+    def calls(self) -> list[tuple[str, str]]:
+        return [
+            (type(method).__name__, getattr(method, "text", None) or getattr(method, "caption", None))
+            for method in self.session.calls
+        ]
+
+    async def test_media_waits_for_earlier_texts(self) -> None:
+        B.notify_admin_text(CLIENT, "Client", "see attached")
+        B.notify_admin_media(CLIENT, "Client", partial(
+            B.bot.copy_message, chat_id=ADMIN, from_chat_id=CLIENT, message_id=2, caption="photo",
+        ))
+        B.notify_admin_text(CLIENT, "Client", "and one more")
+        await self.stop_loop()
+
+        self.assertEqual(
+            [
+                ("SendMessage", f"💬 Сообщение от Client\nID: {CLIENT}\n\nsee attached\n"),
+                ("CopyMessage", "photo"),
+                ("SendMessage", f"💬 Сообщение от Client\nID: {CLIENT}\n\nand one more\n"),
+            ],
+            self.calls(),
+        )
+
+    async def test_media_does_not_wait_for_batch_interval(self) -> None:
+        B.notify_admin_text(CLIENT, "Client", "see attached")
+        B.notify_admin_media(CLIENT, "Client", partial(
+            B.bot.copy_message, chat_id=ADMIN, from_chat_id=CLIENT, message_id=2, caption="photo",
+        ))
+        await asyncio.sleep(0.1)
+        self.assertEqual(["SendMessage", "CopyMessage"], [name for name, _ in self.calls()])
+        await self.stop_loop()
+
+
+if __name__ == "__main__":
+    unittest.main()
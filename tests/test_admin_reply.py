@@ -0,0 +1,122 @@
+"""Куда уходит ответ админа: кнопка «Ответить» и reply на уведомление"""
+
+import asyncio
+import unittest
+
+from aiogram import Bot
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+
+from support import ADMIN, BOT_ID, FakeSession, configure
+
+import bot as B
+
+CLIENT_A = 111
+CLIENT_B = 222
+
+
+def notification(user_id: int, message_id: int) -> dict:
+    """Уведомление бота о сообщении клиента с кнопками"""
+    return {
+        "message_id": message_id,
+        "date": 0,
+        "chat": {"id": ADMIN, "type": "private"},
+        "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bot"},
+        "text": f"💬 Сообщение от клиента\nID: {user_id}",
+        "reply_markup": {"inline_keyboard": [
+            [{"text": "✉️ Ответить", "callback_data": f"reply:{user_id}"}],
+            [{"text": "📜 История", "callback_data": f"history:{user_id}"}],
+        ]},
+    }
+
+
+def admin_text(update_id: int, text: str, reply_to: dict | None = None) -> Update:
+    message = {
+        "message_id": update_id,
+        "date": 0,
+        "chat": {"id": ADMIN, "type": "private"},
+        "from": {"id": ADMIN, "is_bot": False, "first_name": "Admin"},
+        "text": text,
+    }
+    if reply_to is not None:
+        message["reply_to_message"] = reply_to
+    return Update(update_id=update_id, message=message)
+
+
+def press_reply(update_id: int, user_id: int) -> Update:
+    return Update(update_id=update_id, callback_query={
+        "id": str(update_id),
+        "from": {"id": ADMIN, "is_bot": False, "first_name": "Admin"},
+        "chat_instance": "admin",
+        "data": f"reply:{user_id}",
+        "message": notification(user_id, 600 + update_id),
+    })
+
+
+def setUpModule() -> None:
+    global dp
+    dp = configure()
+
+
+class AdminReplyTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.session = FakeSession()
+        B.bot = Bot(token=B.settings.token, session=self.session)
+        B.msg_queue = asyncio.Queue()
+        await dp.storage.close()
+        dp.fsm.storage = MemoryStorage()
+
+    async def feed(self, update: Update) -> None:
+        await dp.feed_update(B.bot, update)
+
+    def sent(self) -> list[tuple[int, str]]:
+        return [
+            (method.chat_id, method.text)
+            for method in self.session.calls
+            if type(method).__name__ == "SendMessage"
+        ]
+
+    def deleted(self) -> list[int]:
+        return [
+            method.message_id
+            for method in self.session.calls
+            if type(method).__name__ == "DeleteMessage"
+        ]
+
+    async def test_quote_reply_wins_over_pending_reply(self) -> None:
+        await self.feed(press_reply(1, CLIENT_A))
+        prompt_id = self.session._message_id
+
+        await self.feed(admin_text(2, "answer meant for B", notification(CLIENT_B, 700)))
+        self.assertIn((CLIENT_B, "answer meant for B"), self.sent())
+        self.assertNotIn((CLIENT_A, "answer meant for B"), self.sent())
+        self.assertNotIn(prompt_id, self.deleted())
+
+        # Ответ клиенту A всё ещё ожидается
+        await self.feed(admin_text(3, "answer for A"))
+        self.assertIn((CLIENT_A, "answer for A"), self.sent())
+        self.assertIn(prompt_id, self.deleted())
+
+    async def test_quote_reply_to_pending_client_completes_reply(self) -> None:
+        await self.feed(press_reply(1, CLIENT_A))
+        prompt_id = self.session._message_id
+
+        await self.feed(admin_text(2, "answer for A", notification(CLIENT_A, 700)))
+        self.assertEqual([(CLIENT_A, "answer for A")], [m for m in self.sent() if m[0] == CLIENT_A])
+        self.assertIn(prompt_id, self.deleted())
+
+    async def test_reply_to_bot_message_without_button_gets_hint(self) -> None:
+        quoted = notification(CLIENT_B, 700)
+        del quoted["reply_markup"]
+        await self.feed(admin_text(1, "hello?", quoted))
+        self.assertEqual([(ADMIN, B.REPLY_TARGET_UNKNOWN)], self.sent())
+
+    async def test_reply_to_colleague_is_ignored(self) -> None:
+        quoted = notification(CLIENT_B, 700)
+        quoted["from"] = {"id": 7, "is_bot": False, "first_name": "Colleague"}
+        await self.feed(admin_text(1, "ok", quoted))
+        self.assertEqual([], self.sent())
+
+
+if __name__ == "__main__":
+    unittest.main()
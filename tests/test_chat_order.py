@@ -0,0 +1,35 @@
+"""Порядок обработки обновлений и ожидание незавершённых при остановке"""
+
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+import support  # noqa: F401  (путь к модулю bot)
+
+from bot import ChatOrderMiddleware
+
+
+class ChatOrderMiddlewareTest(unittest.IsolatedAsyncioTestCase):
+    async def test_wait_idle_waits_for_started_updates(self) -> None:
+        middleware = ChatOrderMiddleware()
+        done = []
+
+        async def handler(event, data):
+            await asyncio.sleep(0.05)
+            done.append(event)
+
+        # Как при handle_as_tasks: задачи созданы, но ещё ни разу не выполнялись
+        for event, chat_id in (("a1", 1), ("a2", 1), ("b1", 2), ("no-chat", None)):
+            chat = SimpleNamespace(id=chat_id) if chat_id is not None else None
+            asyncio.create_task(middleware(handler, event, {"event_chat": chat}))
+
+        await middleware.wait_idle()
+        self.assertCountEqual(["a1", "a2", "b1", "no-chat"], done)
+        self.assertLess(done.index("a1"), done.index("a2"))
+
+    async def test_wait_idle_returns_at_once_without_updates(self) -> None:
+        await asyncio.wait_for(ChatOrderMiddleware().wait_idle(), 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
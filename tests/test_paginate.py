@@ -0,0 +1,36 @@
+"""Разбиение длинных текстов на страницы в пределах лимита Telegram"""
+
+import unittest
+
+import support  # noqa: F401  (путь к модулю bot)
+
+from bot import PAGE_LIMIT, paginate, telegram_len
+
+
+class PaginateTest(unittest.TestCase):
+    def test_plain_text_ampersand_does_not_cut_page(self) -> None:
+        pages = paginate(["💬 Сообщение\n", "Q&A " + "x" * 5000], html=False)
+        self.assertEqual(2, len(pages))
+        self.assertEqual(PAGE_LIMIT, telegram_len(pages[0]))
+        self.assertTrue(pages[0].startswith("💬 Сообщение\n\nQ&A x"))
+
+    def test_html_entities_are_not_split(self) -> None:
+        pages = paginate(["Q&amp;A " * 1000])
+        self.assertGreater(len(pages), 1)
+        for page in pages:
+            amp = page.rfind("&")
+            self.assertTrue(amp == -1 or ";" in page[amp:], page[-10:])
+        self.assertEqual("Q&amp;A " * 1000, "".join(pages))
+
+    def test_limit_counts_utf16_units(self) -> None:
+        pages = paginate(["😀" * 3000])
+        self.assertEqual([PAGE_LIMIT, 6000 - PAGE_LIMIT], [telegram_len(page) for page in pages])
+        self.assertEqual("😀" * 3000, "".join(pages))
+
+    def test_parts_that_fit_a_page_are_not_cut(self) -> None:
+        pages = paginate(["a" * 3000, "b" * 2000])
+        self.assertEqual(["a" * 3000, "b" * 2000], pages)
+
+
+if __name__ == "__main__":
+    unittest.main()